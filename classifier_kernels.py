@@ -0,0 +1,120 @@
+# classifier_kernels.py
+"""
+Compiled HSV kernels used by HSVBagClassifier (final.py).
+- hsv_scan(): one pass over the ROI -> per-class match counts + H/S/V sums
+- Picks the fastest available backend:
+  1) hsv_kernel.so (NEON C, see hsv_kernel.c for the build line)
+  2) Numba
+  3) neither -> hsv_scan is None and the classifier uses cv2.inRange
+"""
+
+import ctypes
+import os
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # Numba not installed (e.g. bare Pi image)
+    njit = None
+
+C_KERNEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hsv_kernel.so")
+
+# Numba hsv_scan works in TILE x TILE blocks (64x64x3 bytes fits in L1)
+TILE = 64
+
+
+def _load_c_kernel():
+    """Return the NEON hsv_scan from hsv_kernel.so, or None if unavailable."""
+    try:
+        lib = ctypes.CDLL(C_KERNEL_PATH)
+    except OSError:
+        return None
+
+    lib.hsv_kernel_has_neon.restype = ctypes.c_int
+    if not lib.hsv_kernel_has_neon():
+        # Scalar C build; Numba is faster on these hosts
+        return None
+
+    u8 = np.ctypeslib.ndpointer(dtype=np.uint8, flags="C_CONTIGUOUS")
+    u32 = np.ctypeslib.ndpointer(dtype=np.uint32, flags="C_CONTIGUOUS")
+    fn = lib.hsv_scan
+    fn.argtypes = [u8, ctypes.c_int, ctypes.c_int, u8, u8, u32, u32]
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_c_hsv_scan = _load_c_kernel()
+
+
+if _c_hsv_scan is not None:
+
+    def hsv_scan(roi, lowers, uppers):
+        """roi: (h, w, 3) uint8 HSV. lowers/uppers: (N, 3) uint8 inclusive bounds.
+        Returns (counts[N], sum_h, sum_s, sum_v).
+        """
+        roi = np.ascontiguousarray(roi, dtype=np.uint8)
+        counts = np.zeros(lowers.shape[0], dtype=np.uint32)
+        sums = np.zeros(3, dtype=np.uint32)
+        rc = _c_hsv_scan(
+            roi, roi.shape[0] * roi.shape[1], lowers.shape[0],
+            lowers, uppers, counts, sums,
+        )
+        if rc != 0:
+            raise ValueError(f"hsv_kernel: unsupported class count {lowers.shape[0]}")
+        return counts.astype(np.int64), int(sums[0]), int(sums[1]), int(sums[2])
+
+elif njit is not None:
+
+    @njit(cache=True)
+    def _in_range(lowers, uppers, c, h, s, v):
+        return (
+            lowers[c, 0] <= h <= uppers[c, 0]
+            and lowers[c, 1] <= s <= uppers[c, 1]
+            and lowers[c, 2] <= v <= uppers[c, 2]
+        )
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def hsv_scan(roi, lowers, uppers):
+        """roi: (h, w, 3) uint8 HSV. lowers/uppers: (N, 3) uint8 inclusive bounds.
+        Returns (counts[N], sum_h, sum_s, sum_v).
+        """
+        rows = roi.shape[0]
+        cols = roi.shape[1]
+        n = lowers.shape[0]
+        tiles_x = (cols + TILE - 1) // TILE
+        tiles = ((rows + TILE - 1) // TILE) * tiles_x
+
+        # Per-tile accumulators so parallel tiles never write the same slot;
+        # every reduction for a tile happens while it is still in L1
+        tile_counts = np.zeros((tiles, n), np.int64)
+        tile_sums = np.zeros((tiles, 3), np.int64)
+
+        for t in prange(tiles):
+            y0 = (t // tiles_x) * TILE
+            x0 = (t % tiles_x) * TILE
+            y1 = min(y0 + TILE, rows)
+            x1 = min(x0 + TILE, cols)
+            sh = 0
+            ss = 0
+            sv = 0
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    h = roi[y, x, 0]
+                    s = roi[y, x, 1]
+                    v = roi[y, x, 2]
+                    sh += h
+                    ss += s
+                    sv += v
+                    for c in range(n):
+                        if _in_range(lowers, uppers, c, h, s, v):
+                            tile_counts[t, c] += 1
+            tile_sums[t, 0] = sh
+            tile_sums[t, 1] = ss
+            tile_sums[t, 2] = sv
+
+        sums = tile_sums.sum(axis=0)
+        return tile_counts.sum(axis=0), sums[0], sums[1], sums[2]
+
+else:
+    hsv_scan = None
@@ -9,14 +9,21 @@ AWSS Engine (final.py)
 - Designed to be IMPORTED by Flask (do not run as main for the dashboard)
 """
 
-from picamera2 import Picamera2
+from picamera2 import Picamera2, MappedArray
+from libcamera import ColorSpace
 import RPi.GPIO as GPIO
 import cv2
+import hashlib
 import numpy as np
 import time
 import os
+import queue
+import threading
+from dataclasses import dataclass
 from datetime import datetime
 
+from classifier_kernels import hsv_scan
+
 # ====== HARDWARE CONFIG ======
 IR_PIN_DEFAULT = 23  # BCM numbering
 # Old logic in your file: HIGH=clear, LOW=broken
@@ -24,6 +31,38 @@ IR_CLEAR_LEVEL = GPIO.HIGH
 IR_BROKEN_LEVEL = GPIO.LOW
 
 
+# ====== RESULT ======
+@dataclass(slots=True)
+class BagResult:
+    """One classified bag. Flat fields; to_dict() gives the dashboard JSON shape
+    (built only when a response is serialized)."""
+    timestamp: str
+    category: str
+    color: str
+    confidence: float  # 0..100
+    reason: str
+    hsv_h: float
+    hsv_s: float
+    hsv_v: float
+    class_names: tuple  # the classifier's class order (shared, not copied)
+    match_pct: tuple    # % of ROI pixels in each class's range, same order
+    image_path: str = ""      # relative path used by Flask
+    image_filename: str = ""
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "category": self.category,
+            "color": self.color,
+            "confidence": self.confidence,
+            "reason": self.reason,
+            "hsv": {"h": self.hsv_h, "s": self.hsv_s, "v": self.hsv_v},
+            "color_matches": dict(zip(self.class_names, self.match_pct)),
+            "image_path": self.image_path,
+            "image_filename": self.image_filename,
+        }
+
+
 # ====== IR SENSOR ======
 class IRSensor:
     """IR Breakbeam sensor using RPi.GPIO.
@@ -40,6 +79,10 @@ class IRSensor:
         # Input with pull-up (matches your old file)
         GPIO.setup(self.pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 
+        # Kernel edge waits; switched off (-> GPIO.input polling) if the
+        # board's RPi.GPIO can't do edge detection
+        self._edge_wait = True
+
         print(f"  - IR sensor initialized on GPIO {self.pin}")
         print("    Logic: HIGH=clear, LOW=broken")
 
@@ -49,21 +92,58 @@ class IRSensor:
     def is_broken(self) -> bool:
         return GPIO.input(self.pin) == IR_BROKEN_LEVEL
 
+    def _edge_wait_failed(self, e):
+        """Fall back to polling for good (warn once)."""
+        if self._edge_wait:
+            print(f"  ⚠ GPIO edge wait unavailable ({e}); polling IR sensor instead")
+        self._edge_wait = False
+
     def wait_for_bag(self, debounce_ms=80):
-        """Block until beam is broken (bag detected). Includes small debounce."""
-        # Wait for transition into broken state
-        while self.is_clear():
-            time.sleep(0.01)
-
-        # Debounce: ensure it stays broken briefly
-        t0 = time.time()
-        while (time.time() - t0) < (debounce_ms / 1000.0):
+        """Block until beam is broken (bag detected). Includes small debounce.
+        Sleeps in the kernel on a falling edge instead of polling GPIO.input
+        (polls if edge detection is unavailable).
+        """
+        while True:
             if self.is_clear():
-                # false trigger; restart
-                return self.wait_for_bag(debounce_ms=debounce_ms)
-            time.sleep(0.005)
-
-        # Confirmed bag detection
+                # Wait for transition into broken state. The timeout only
+                # guards against an edge landing between is_clear() and here.
+                if self._edge_wait:
+                    try:
+                        GPIO.wait_for_edge(
+                            self.pin, GPIO.FALLING, bouncetime=debounce_ms, timeout=1000
+                        )
+                    except RuntimeError as e:
+                        self._edge_wait_failed(e)
+                if not self._edge_wait:
+                    while self.is_clear():
+                        time.sleep(0.01)
+                if self.is_clear():
+                    continue
+
+            # Debounce: ensure it is still broken after a short settle
+            time.sleep(debounce_ms / 1000.0)
+            if self.is_broken():
+                # Confirmed bag detection
+                return True
+            # false trigger; wait for the next edge
+
+    def wait_for_clear(self, timeout_ms=2000) -> bool:
+        """Block until the beam clears (rising edge) or timeout. True if clear.
+        Re-checks the pin until the deadline, so a bounce or an early return
+        from the edge wait can't end the wait while the beam is still broken.
+        """
+        deadline = time.time() + timeout_ms / 1000.0
+        while not self.is_clear():
+            remaining_ms = int((deadline - time.time()) * 1000)
+            if remaining_ms <= 0:
+                return False
+            if self._edge_wait:
+                try:
+                    GPIO.wait_for_edge(self.pin, GPIO.RISING, timeout=remaining_ms)
+                    continue
+                except RuntimeError as e:
+                    self._edge_wait_failed(e)
+            time.sleep(min(0.05, remaining_ms / 1000.0))
         return True
 
     def verify_sensor(self, timeout=5) -> bool:
@@ -127,48 +207,87 @@ class HSVBagClassifier:
             "green": "COMPOST",
         }
 
-    def classify_hsv(self, hsv_image):
-        # Use center ROI for stability
-        h, w = hsv_image.shape[:2]
-        roi = hsv_image[h // 4 : 3 * h // 4, w // 4 : 3 * w // 4]
+        self._class_names = tuple(self.hsv_ranges)
+        self._i_blue, self._i_green = (
+            self._class_names.index(c) for c in ("blue", "green")
+        )
+
+        # (N, h, w) cv2.inRange dst buffers for the non-kernel path, reused across bags
+        self._masks = None
 
-        avg_h, avg_s, avg_v = np.mean(roi, axis=(0, 1))
-        color_matches = {}
+        # Same ranges packed as (N, 3) uint8 bounds (compiled kernel + inRange)
+        self.lowers = np.array(
+            [self.hsv_ranges[c]["lower"] for c in self._class_names], dtype=np.uint8
+        )
+        self.uppers = np.array(
+            [self.hsv_ranges[c]["upper"] for c in self._class_names], dtype=np.uint8
+        )
 
-        for color_name, r in self.hsv_ranges.items():
-            mask = cv2.inRange(roi, r["lower"], r["upper"])
-            match_pct = (np.sum(mask > 0) / mask.size) * 100.0
-            color_matches[color_name] = match_pct
+    def _scan(self, roi):
+        """Return (per-class match counts, avg_h, avg_s, avg_v) for the ROI."""
+        if hsv_scan is not None:
+            # Numba kernel: single pass for counts and channel sums
+            counts, sh, ss, sv = hsv_scan(roi, self.lowers, self.uppers)
+            n = roi.shape[0] * roi.shape[1]
+            return counts, sh / n, ss / n, sv / n
+
+        avg_h, avg_s, avg_v = cv2.mean(roi)[:3]
+
+        # Only reallocate the mask buffers if the ROI size changes
+        shape = (len(self._class_names),) + roi.shape[:2]
+        if self._masks is None or self._masks.shape != shape:
+            self._masks = np.empty(shape, dtype=np.uint8)
+        m = self._masks
+
+        # One inRange per class, written straight into its preallocated mask
+        for i in range(len(self._class_names)):
+            cv2.inRange(roi, self.lowers[i], self.uppers[i], dst=m[i])
+        counts = np.array([cv2.countNonZero(mask) for mask in m])
+        return counts, avg_h, avg_s, avg_v
+
+    def classify_hsv(self, roi):
+        """Classify an HSV image that is already cropped to the center ROI.
+        Returns a BagResult (timestamp/image fields are filled in by AWSSSystem)."""
+        counts, avg_h, avg_s, avg_v = self._scan(roi)
+
+        # Match % per class, indexed like self._class_names
+        pct = np.asarray(counts) / (roi.shape[0] * roi.shape[1]) * 100.0
+        blue_pct = float(pct[self._i_blue])
+        green_pct = float(pct[self._i_green])
 
         # Decision logic (from your old file idea)
-        if color_matches["blue"] > 30:
+        if blue_pct > 30:
             color = "blue"
-            confidence = min(95.0, color_matches["blue"])
-            reason = f"Blue range match: {color_matches['blue']:.1f}%"
+            confidence = min(95.0, blue_pct)
+            reason = f"Blue range match: {blue_pct:.1f}%"
         elif avg_v < 120:
             color = "black"
             confidence = float((120.0 - avg_v) / 120.0 * 100.0)
             confidence = max(0.0, min(95.0, confidence))
             reason = f"V={avg_v:.1f} < 120 (low brightness)"
-        elif color_matches["green"] > 20:
+        elif green_pct > 20:
             color = "green"
-            confidence = min(95.0, color_matches["green"])
-            reason = f"Green range match: {color_matches['green']:.1f}%"
+            confidence = min(95.0, green_pct)
+            reason = f"Green range match: {green_pct:.1f}%"
         else:
-            color = max(color_matches, key=color_matches.get)
-            confidence = float(color_matches[color])
-            reason = f"Best match: {color_matches[color]:.1f}%"
-
-        category = self.categories[color]
-
-        return {
-            "color": color,
-            "category": category,
-            "hsv": {"h": float(avg_h), "s": float(avg_s), "v": float(avg_v)},
-            "confidence": float(confidence),  # 0..100
-            "reason": reason,
-            "color_matches": {k: float(v) for k, v in color_matches.items()},
-        }
+            # argmax keeps the first class on ties, same as max() over the dict did
+            best = int(pct.argmax())
+            color = self._class_names[best]
+            confidence = float(pct[best])
+            reason = f"Best match: {confidence:.1f}%"
+
+        return BagResult(
+            timestamp="",
+            category=self.categories[color],
+            color=color,
+            confidence=float(confidence),
+            reason=reason,
+            hsv_h=float(avg_h),
+            hsv_s=float(avg_s),
+            hsv_v=float(avg_v),
+            class_names=self._class_names,
+            match_pct=tuple(pct.tolist()),
+        )
 
 
 # ====== AWSS ENGINE ======
@@ -177,7 +296,9 @@ class AWSSSystem:
     Engine controlled by Flask:
     - start(): starts camera
     - stop(): stops camera + cleans GPIO
-    - process_bag(): capture -> HSV -> result dict + save image/log
+    - process_bag(): capture -> HSV -> BagResult + save image/log
+      (images are encoded + written by a background thread)
+    - latest_image(): newest encoded JPEG, for serving from memory
     """
 
     def __init__(self, delay_after_trigger=1.0, ir_pin=IR_PIN_DEFAULT):
@@ -195,15 +316,42 @@ class AWSSSystem:
         # Camera init (Picamera2)
         print("\n  - Setting up Pi Camera (Picamera2)...")
         self.camera = Picamera2()
+        # main: full-res "BGR888" for the saved JPEG. Its arrays come out in
+        # the same byte order the old RGB888 + cvtColor(RGB2BGR) path produced,
+        # so the HSV ranges stay valid.
+        # lores: 640x360 YUV420 used for classification (HSV stats of the
+        # center ROI don't need full resolution)
+        # Still config keeps the old exposure limits (the HSV ranges were tuned
+        # on it). Smpte170m = limited-range BT.601, which is what
+        # cv2.COLOR_YUV2RGB_I420 decodes; the default Sycc (full range) would
+        # come out contrast-stretched and shift V.
         config = self.camera.create_still_configuration(
-            main={"size": (1920, 1080), "format": "RGB888"}
+            main={"size": (1920, 1080), "format": "BGR888"},
+            lores={"size": (640, 360), "format": "YUV420"},
+            colour_space=ColorSpace.Smpte170m(),
+            buffer_count=4,
         )
         self.camera.configure(config)
 
+        # JPEG encode + write happen on a background thread; a small bounded
+        # queue keeps process_bag from waiting on them without unbounded backlog
+        self._write_q = queue.Queue(maxsize=2)
+        self._image_cond = threading.Condition()
+        self._pending_filename = None  # newest capture handed to the writer
+        self._last_image = None        # (filename, jpeg bytes, md5 hex) once encoded
+        threading.Thread(target=self._writer_loop, daemon=True).start()
+
         self.running = False
         self.total_bags = 0
         self.results_log = []
 
+        # Open append handle for today's log (reopened when the date changes).
+        # The lock covers stop() closing it while a bag is still being logged.
+        self._log_lock = threading.Lock()
+        self._log_fh = None
+        self._log_date = None
+        self._log_closed = False  # set by stop()
+
         print("✓ AWSSSystem initialized")
 
     def start(self):
@@ -214,6 +362,10 @@ class AWSSSystem:
         print("\nStarting camera...")
         self.camera.start()
         time.sleep(1.5)  # warmup
+
+        # Compile the HSV kernel now so the first real bag doesn't pay for it
+        self.classifier.classify_hsv(np.zeros((8, 8, 3), dtype=np.uint8))
+
         self.running = True
 
         # Optional IR sanity check (don’t hard-exit in dashboard mode)
@@ -235,25 +387,105 @@ class AWSSSystem:
             self.ir_sensor.cleanup()
         except Exception:
             pass
+        with self._log_lock:
+            self._log_closed = True
+            try:
+                if self._log_fh:
+                    self._log_fh.close()
+            except Exception:
+                pass
+            self._log_fh = None
+            self._log_date = None
+        try:
+            # Writer exits after flushing whatever is still queued
+            self._write_q.put(None, timeout=2.0)
+        except queue.Full:
+            pass
         print("✓ System stopped")
 
-    def _save_log(self, entry: dict):
-        log_file = os.path.join(self.log_dir, f"awss_log_{datetime.now().strftime('%Y%m%d')}.txt")
-        with open(log_file, "a") as f:
-            f.write(f"\n{'='*60}\n")
-            f.write(f"Time: {entry['timestamp']}\n")
-            f.write(f"Color: {entry.get('color','')}\n")
-            f.write(f"Category: {entry.get('category','')}\n")
-            hsv = entry.get("hsv") or {}
-            f.write(f"HSV: H={hsv.get('h','—')}, S={hsv.get('s','—')}, V={hsv.get('v','—')}\n")
-            f.write(f"Confidence: {entry.get('confidence',0):.1f}%\n")
-            f.write(f"Reason: {entry.get('reason','')}\n")
-            f.write(f"Image: {entry.get('image_path','')}\n")
+    def latest_image(self, filename=None, timeout=2.0):
+        """
+        Return (filename, jpeg bytes, md5 hex) of the newest encoded capture,
+        or None. If `filename` is the capture still being encoded, wait up to
+        `timeout` seconds for it.
+        """
+        with self._image_cond:
+            if filename is not None and filename == self._pending_filename:
+                self._image_cond.wait_for(
+                    lambda: self._last_image is not None and self._last_image[0] == filename,
+                    timeout,
+                )
+            return self._last_image
+
+    def _writer_loop(self):
+        """Encode + write queued (path, bgr) captures until stop() sends None."""
+        while True:
+            item = self._write_q.get()
+            if item is None:
+                break
+            path, frame_bgr = item
+
+            try:
+                ok, buf = cv2.imencode(".jpg", frame_bgr, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            except Exception:
+                ok = False  # keep the writer alive for later captures
+            if not ok:
+                print(f"  ⚠ Failed to encode image for {path}")
+                continue
+            jpeg = buf.tobytes()
+
+            # Publish for /latest-image before touching disk
+            with self._image_cond:
+                self._last_image = (os.path.basename(path), jpeg, hashlib.md5(jpeg).hexdigest())
+                self._image_cond.notify_all()
+
+            try:
+                # Already-encoded bytes: a raw fd write, no extra buffering layer
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    view = memoryview(jpeg)
+                    while view:
+                        view = view[os.write(fd, view):]
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                print(f"  ⚠ Failed to write image to {path}: {e}")
+
+    def _save_log(self, entry: BagResult):
+        # Log day comes from the entry's ISO timestamp ("YYYY-MM-DD...")
+        day = entry.timestamp[:10].replace("-", "")
+        log_file = os.path.join(self.log_dir, f"awss_log_{day}.txt")
+        text = (
+            f"\n{'='*60}\n"
+            f"Time: {entry.timestamp}\n"
+            f"Color: {entry.color}\n"
+            f"Category: {entry.category}\n"
+            f"HSV: H={entry.hsv_h}, S={entry.hsv_s}, V={entry.hsv_v}\n"
+            f"Confidence: {entry.confidence:.1f}%\n"
+            f"Reason: {entry.reason}\n"
+            f"Image: {entry.image_path}\n"
+        )
+
+        with self._log_lock:
+            if self._log_closed:
+                # Bag finished after stop(): append once, keep no handle open
+                with open(log_file, "a") as f:
+                    f.write(text)
+                return
+
+            if day != self._log_date:
+                if self._log_fh:
+                    self._log_fh.close()
+                self._log_fh = open(log_file, "a", buffering=8192)
+                self._log_date = day
+
+            self._log_fh.write(text)
+            self._log_fh.flush()
 
     def process_bag(self):
         """
         Called after IR trigger by Flask worker.
-        Captures image, classifies, saves, returns structured dict.
+        Captures image, classifies, saves, returns a BagResult.
         """
         if not self.running:
             # still allow process_bag in testing, but camera should be started
@@ -265,32 +497,46 @@ class AWSSSystem:
         time.sleep(self.delay_after_trigger)
 
         # Capture
-        ts_iso = datetime.now().isoformat()
-        ts_name = datetime.now().strftime("%Y%m%d_%H%M%S")
+        now = datetime.now()
+        ts_iso = now.isoformat()
+        ts_name = now.strftime("%Y%m%d_%H%M%S")
         filename = f"bag_{ts_name}.jpg"
         image_path = os.path.join(self.capture_dir, filename)
 
-        frame_rgb = self.camera.capture_array()
-        frame_bgr = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)
-        ok = cv2.imwrite(image_path, frame_bgr)
-        if not ok:
-            raise RuntimeError(f"Failed to write image to {image_path}")
-
-        # HSV + classify
-        frame_hsv = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2HSV)
-        c = self.classifier.classify_hsv(frame_hsv)
-
-        result = {
-            "timestamp": ts_iso,
-            "category": c["category"],
-            "color": c["color"],
-            "confidence": c["confidence"],   # 0..100
-            "reason": c["reason"],
-            "hsv": c["hsv"],
-            "color_matches": c["color_matches"],
-            "image_path": image_path,        # relative path used by Flask
-            "image_filename": filename,
-        }
+        # Both streams from the same request, so they show the same frame.
+        # lores is read straight from the mapped request buffer; main is
+        # copied out, because the writer thread encodes it after release.
+        req = self.camera.capture_request()
+        try:
+            with MappedArray(req, "lores") as m:
+                # YUV2RGB gives the same channel order as the main stream (see __init__)
+                lores_bgr = cv2.cvtColor(m.array, cv2.COLOR_YUV2RGB_I420)
+            frame_bgr = req.make_array("main")
+        finally:
+            req.release()
+
+        # Center ROI for stability; crop first so only the ROI goes to HSV
+        h, w = lores_bgr.shape[:2]
+        roi_bgr = lores_bgr[h // 4 : 3 * h // 4, w // 4 : 3 * w // 4]
+        roi_hsv = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2HSV)
+        result = self.classifier.classify_hsv(roi_hsv)
+
+        result.timestamp = ts_iso
+        result.image_path = image_path
+        result.image_filename = filename
+
+        # JPEG encode + write happen on the writer thread, after classification
+        try:
+            self._write_q.put_nowait((image_path, frame_bgr))
+        except queue.Full:
+            # Writer is behind: skip saving this capture (earlier ones are
+            # already logged/published) and don't point log/history at it
+            print(f"  ⚠ Image writer busy, capture not saved: {image_path}")
+            result.image_path = ""
+            result.image_filename = ""
+        else:
+            with self._image_cond:
+                self._pending_filename = filename
 
         self.results_log.append(result)
         self._save_log(result)
@@ -0,0 +1,125 @@
+/*
+ * hsv_kernel.c
+ * NEON HSV range-check kernel for HSVBagClassifier (loaded by classifier_kernels.py).
+ *
+ * Build on the Pi (next to final.py):
+ *   gcc -O3 -shared -fPIC -o hsv_kernel.so hsv_kernel.c
+ *   (32-bit Raspberry Pi OS: add -mfpu=neon)
+ *
+ * Without NEON the same file builds a scalar version; classifier_kernels.py
+ * only prefers it over Numba when hsv_kernel_has_neon() returns 1.
+ */
+
+#include <stdint.h>
+
+#if defined(__ARM_NEON) || defined(__ARM_NEON__)
+#include <arm_neon.h>
+#define HSV_HAVE_NEON 1
+#else
+#define HSV_HAVE_NEON 0
+#endif
+
+#define HSV_MAX_CLASSES 8
+
+int hsv_kernel_has_neon(void)
+{
+    return HSV_HAVE_NEON;
+}
+
+#if HSV_HAVE_NEON
+static uint32_t hsum_u32(uint32x4_t v)
+{
+    uint64x2_t p = vpaddlq_u32(v);
+    return (uint32_t)(vgetq_lane_u64(p, 0) + vgetq_lane_u64(p, 1));
+}
+#endif
+
+/*
+ * roi:      n_pixels interleaved H,S,V bytes (contiguous)
+ * lowers:   n_classes x 3 inclusive lower bounds
+ * uppers:   n_classes x 3 inclusive upper bounds
+ * counts:   out, n_classes matching-pixel counts
+ * sums:     out, H/S/V channel sums
+ * Returns 0 on success, -1 if n_classes is out of range.
+ */
+int hsv_scan(const uint8_t *roi, int n_pixels, int n_classes,
+             const uint8_t *lowers, const uint8_t *uppers,
+             uint32_t *counts, uint32_t *sums)
+{
+    int i = 0;
+    int c;
+
+    if (n_classes < 0 || n_classes > HSV_MAX_CLASSES)
+        return -1;
+
+    for (c = 0; c < n_classes; c++)
+        counts[c] = 0;
+    sums[0] = sums[1] = sums[2] = 0;
+
+#if HSV_HAVE_NEON
+    {
+        uint8x16_t lo[HSV_MAX_CLASSES][3], hi[HSV_MAX_CLASSES][3];
+        uint32x4_t acc[HSV_MAX_CLASSES];
+        uint32x4_t sum_h = vdupq_n_u32(0);
+        uint32x4_t sum_s = vdupq_n_u32(0);
+        uint32x4_t sum_v = vdupq_n_u32(0);
+        int ch;
+
+        for (c = 0; c < n_classes; c++) {
+            for (ch = 0; ch < 3; ch++) {
+                lo[c][ch] = vdupq_n_u8(lowers[c * 3 + ch]);
+                hi[c][ch] = vdupq_n_u8(uppers[c * 3 + ch]);
+            }
+            acc[c] = vdupq_n_u32(0);
+        }
+
+        /* 16 pixels per iteration: vld3q de-interleaves H, S and V */
+        for (; i + 16 <= n_pixels; i += 16) {
+            uint8x16x3_t px = vld3q_u8(roi + 3 * i);
+
+            sum_h = vpadalq_u16(sum_h, vpaddlq_u8(px.val[0]));
+            sum_s = vpadalq_u16(sum_s, vpaddlq_u8(px.val[1]));
+            sum_v = vpadalq_u16(sum_v, vpaddlq_u8(px.val[2]));
+
+            for (c = 0; c < n_classes; c++) {
+                uint8x16_t m = vandq_u8(vcgeq_u8(px.val[0], lo[c][0]),
+                                        vcleq_u8(px.val[0], hi[c][0]));
+                m = vandq_u8(m, vandq_u8(vcgeq_u8(px.val[1], lo[c][1]),
+                                         vcleq_u8(px.val[1], hi[c][1])));
+                m = vandq_u8(m, vandq_u8(vcgeq_u8(px.val[2], lo[c][2]),
+                                         vcleq_u8(px.val[2], hi[c][2])));
+                /* 0xFF lanes -> 1, then widen so the count can't wrap */
+                acc[c] = vpadalq_u16(acc[c], vpaddlq_u8(vshrq_n_u8(m, 7)));
+            }
+        }
+
+        for (c = 0; c < n_classes; c++)
+            counts[c] = hsum_u32(acc[c]);
+        sums[0] = hsum_u32(sum_h);
+        sums[1] = hsum_u32(sum_s);
+        sums[2] = hsum_u32(sum_v);
+    }
+#endif
+
+    /* Scalar tail (or the whole ROI without NEON) */
+    for (; i < n_pixels; i++) {
+        uint8_t h = roi[3 * i];
+        uint8_t s = roi[3 * i + 1];
+        uint8_t v = roi[3 * i + 2];
+
+        sums[0] += h;
+        sums[1] += s;
+        sums[2] += v;
+
+        for (c = 0; c < n_classes; c++) {
+            const uint8_t *lo = lowers + c * 3;
+            const uint8_t *hi = uppers + c * 3;
+            if (lo[0] <= h && h <= hi[0] &&
+                lo[1] <= s && s <= hi[1] &&
+                lo[2] <= v && v <= hi[2])
+                counts[c]++;
+        }
+    }
+
+    return 0;
+}
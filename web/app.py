@@ -3,46 +3,96 @@ import os
 import sys
 import threading
 import time
+from collections import deque
 from datetime import datetime
 
-from flask import Flask, jsonify, send_file, render_template, send_from_directory
+import orjson
+from flask import (
+    Flask, Response, jsonify, request, send_file, render_template, send_from_directory
+)
+from flask.json.provider import DefaultJSONProvider
 
 # Allow importing final.py from project root
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, BASE_DIR)
 
-from final import AWSSSystem  # uses your existing hardware + CV logic
+from final import AWSSSystem, BagResult  # uses your existing hardware + CV logic
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """jsonify() through orjson: /api/status is polled constantly by the dashboard."""
+
+    @staticmethod
+    def default(o):
+        # BagResults are stored as-is; their nested JSON shape is built here
+        if isinstance(o, BagResult):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        # Passthrough so dataclasses reach default() instead of orjson's flat encoding
+        return orjson.dumps(
+            obj, default=self.default, option=orjson.OPT_PASSTHROUGH_DATACLASS
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 # IMPORTANT: point Flask to web/templates and web/static
 app = Flask(__name__, template_folder="templates", static_folder="static")
+app.json = ORJSONProvider(app)
 
 system = None
 worker_thread = None
 lock = threading.Lock()
+# Set by api_stop. A fresh Event per start, handed to that run's worker, so a
+# worker left over from an earlier run can never pick up the new system.
+stop_event = threading.Event()
+stop_event.set()
+
+MAX_HISTORY = 20
 
 STATE = {
     "running": False,
     "startedAt": None,
-    "last": None,        # latest detection (dict)
-    "history": [],       # list of detections
+    "last": None,        # latest detection (BagResult, or dict for errors)
+    # newest first; O(1) appendleft, oldest entry drops off at MAX_HISTORY
+    "history": deque(maxlen=MAX_HISTORY),
     "lastImagePath": None,
     "lastError": None,
     "bagCount": 0,       # total detections since start
 }
-MAX_HISTORY = 20
 
 
-def _push_history(item: dict):
-    STATE["history"].insert(0, item)
-    if len(STATE["history"]) > MAX_HISTORY:
-        STATE["history"] = STATE["history"][:MAX_HISTORY]
+def _push_history(item):
+    # Caller holds `lock`, so history always agrees with last/bagCount
+    STATE["history"].appendleft(item)
+
+
+def _jpeg_response(data: bytes, etag: str):
+    """JPEG from memory with an ETag; 304 if the client already has it."""
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(data, mimetype="image/jpeg")
+    resp.set_etag(etag)
+    return resp
 
 
 def _safe_ir_clear_wait(ir_sensor, timeout_s=2.0):
     """
-    Optional: if real sensor supports is_broken(), wait for beam to clear.
-    If not supported, just return quickly.
+    Optional: wait for beam to clear.
+    Uses the sensor's edge wait (wait_for_clear) when available; if that is
+    missing or fails, polls is_broken(). If neither works, just return quickly.
     """
+    if hasattr(ir_sensor, "wait_for_clear"):
+        try:
+            ir_sensor.wait_for_clear(timeout_ms=int(timeout_s * 1000))
+            return
+        except Exception:
+            pass  # fall through to polling so the cooldown still happens
+
     if not hasattr(ir_sensor, "is_broken"):
         return
 
@@ -56,21 +106,20 @@ def _safe_ir_clear_wait(ir_sensor, timeout_s=2.0):
         return
 
 
-def worker_loop():
+def worker_loop(stop: threading.Event):
     """
     Background loop:
     wait for IR trigger -> process bag -> update STATE -> cooldown
+    Exits as soon as `stop` is set (checked without taking the lock).
     """
     global system
 
-    while True:
-        with lock:
-            if not STATE["running"]:
-                break
-            local_system = system  # snapshot pointer
+    while not stop.is_set():
+        local_system = system  # snapshot pointer
 
         if not local_system:
-            time.sleep(0.1)
+            if stop.wait(0.1):
+                break
             continue
 
         # Wait for a bag (blocking call)
@@ -79,14 +128,14 @@ def worker_loop():
         except Exception as e:
             with lock:
                 STATE["lastError"] = f"IR sensor error: {e}"
-            time.sleep(0.2)
+            if stop.wait(0.2):
+                break
             continue
 
-        with lock:
-            if not STATE["running"]:
-                break
-            # system could have been swapped during stop/start, re-snapshot
-            local_system = system
+        if stop.is_set():
+            break
+        # system could have been swapped during stop/start, re-snapshot
+        local_system = system
 
         if not local_system:
             continue
@@ -95,27 +144,15 @@ def worker_loop():
         try:
             result = local_system.process_bag()
 
-            image_path = (result or {}).get("image_path")
-
-            payload = {
-                "timestamp": (result or {}).get("timestamp", datetime.now().isoformat()),
-                "category": (result or {}).get("category", "UNKNOWN"),
-                "color": (result or {}).get("color", "unknown"),
-                # final.py returns confidence in 0..100 (float). Keep it consistent.
-                "confidence": float((result or {}).get("confidence", 0.0)),
-                "reason": (result or {}).get("reason", ""),
-                "hsv": (result or {}).get("hsv", None),
-                "color_matches": (result or {}).get("color_matches", None),
-                "image_path": image_path,
-                "image_filename": (result or {}).get("image_filename"),
-            }
-
+            # Kept as a BagResult; ORJSONProvider turns it into the nested
+            # JSON shape when /api/status is serialized.
+            # final.py returns confidence in 0..100 (float).
             with lock:
                 STATE["bagCount"] += 1
-                STATE["last"] = payload
-                STATE["lastImagePath"] = image_path
+                STATE["last"] = result
+                STATE["lastImagePath"] = result.image_path
                 STATE["lastError"] = None
-                _push_history(payload)
+                _push_history(result)
 
         except Exception as e:
             with lock:
@@ -139,7 +176,8 @@ def worker_loop():
             _safe_ir_clear_wait(local_system.ir_sensor, timeout_s=2.0)
         except Exception:
             pass
-        time.sleep(0.5)
+        if stop.wait(0.5):
+            break
 
 
 @app.route("/api/start", methods=["POST"])
@@ -149,7 +187,7 @@ def api_start():
     - If an old system exists, stop it first (prevents camera 'busy')
     - Retry camera acquire a few times (camera can take a moment to release)
     """
-    global system, worker_thread
+    global system, worker_thread, stop_event
 
     with lock:
         if STATE["running"]:
@@ -192,7 +230,7 @@ def api_start():
             STATE["running"] = False
             STATE["startedAt"] = None
             STATE["last"] = None
-            STATE["history"] = []
+            STATE["history"].clear()
             STATE["lastImagePath"] = None
             STATE["lastError"] = f"Start failed: {last_err}"
             STATE["bagCount"] = 0
@@ -200,15 +238,16 @@ def api_start():
 
     with lock:
         system = new_system
+        stop_event = threading.Event()
         STATE["running"] = True
         STATE["startedAt"] = datetime.now().isoformat()
         STATE["last"] = None
-        STATE["history"] = []
+        STATE["history"].clear()
         STATE["lastImagePath"] = None
         STATE["lastError"] = None
         STATE["bagCount"] = 0
 
-    worker_thread = threading.Thread(target=worker_loop, daemon=True)
+    worker_thread = threading.Thread(target=worker_loop, args=(stop_event,), daemon=True)
     worker_thread.start()
 
     return jsonify({"ok": True, "message": "Started"}), 200
@@ -223,6 +262,7 @@ def api_stop():
             return jsonify({"ok": True, "message": "Already stopped"}), 200
 
         STATE["running"] = False
+        stop_event.set()
         old = system
         system = None
 
@@ -243,7 +283,7 @@ def api_status():
             "running": STATE["running"],
             "startedAt": STATE["startedAt"],
             "last": STATE["last"],
-            "history": STATE["history"],
+            "history": list(STATE["history"]),  # same snapshot as last/bagCount
             "lastImagePath": STATE["lastImagePath"],
             "lastError": STATE["lastError"],
             "bagCount": STATE["bagCount"],
@@ -255,6 +295,12 @@ def api_status():
 def latest_image():
     with lock:
         p = STATE["lastImagePath"]
+        local_system = system
+
+    # Newest encoded capture, straight from the engine's memory
+    img = local_system.latest_image() if local_system else None
+    if img:
+        return _jpeg_response(img[1], img[2])
 
     if not p:
         return ("No image yet", 404)
@@ -269,6 +315,15 @@ def latest_image():
 # Serve a specific image by filename (frontend uses image_filename)
 @app.route("/latest-image/<filename>")
 def latest_image_by_name(filename):
+    # The latest capture is served from memory (it may not be on disk yet;
+    # latest_image() waits briefly if it is still being encoded)
+    with lock:
+        local_system = system
+
+    img = local_system.latest_image(filename) if local_system else None
+    if img and img[0] == filename:
+        return _jpeg_response(img[1], img[2])
+
     capture_dir = os.path.join(BASE_DIR, "data", "captures")
     return send_from_directory(capture_dir, filename)
 
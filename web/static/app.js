@@ -149,8 +149,9 @@ function imageUrlFromLast(last) {
   if (!last) return null;
 
   // If backend includes filename, use /latest-image/<filename>
+  // (filenames are unique per capture, so no cache-bust: the browser can reuse it)
   if (last.image_filename) {
-    return `/latest-image/${encodeURIComponent(last.image_filename)}?ts=${Date.now()}`;
+    return `/latest-image/${encodeURIComponent(last.image_filename)}`;
   }
 
   // Fallback: backend provides /latest-image (latest only)
@@ -239,7 +240,7 @@ function updateDetection(last) {
   // update vision overlay timestamp
   els.visionTime.textContent = ts ? fmtTime(ts) : "—";
 
-  // refresh image (cache-bust)
+  // refresh image (same URL = no refetch)
   const url = imageUrlFromLast(last);
   if (url) els.visionImg.src = url;
 